@@ -0,0 +1,68 @@
+"""
+Startup time of `pif.py` on a short script: no cache, cold cache, warm cache.
+
+    python benchmarks/startup.py [-n RUNS] [file.pif]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PIF = os.path.join(HERE, '..', 'pif.py')
+
+SCRIPT = '''\
+fib = func (n number)
+  if ((n <= 2)) do
+    1
+  else
+    a = fib ((n - 1)) .
+    b = fib ((n - 2)) .
+    ((a + b))
+  end
+end
+
+fib 5 . eat_f .
+'''
+
+
+def time_run(*args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, PIF, *args], check=True)
+    return time.perf_counter() - start
+
+
+def report(name, times):
+    ms = [t * 1000 for t in times]
+    print(f'{name:<12} min {min(ms):7.1f}ms  median {statistics.median(ms):7.1f}ms')
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = args.file
+        if not fname:
+            fname = os.path.join(tmp, 'startup.pif')
+            with open(fname, 'w') as f:
+                f.write(SCRIPT)
+
+        report('no cache', [time_run(fname) for _ in range(args.runs)])
+
+        cold = []
+        for i in range(args.runs):
+            cold.append(time_run('--cache-dir', os.path.join(tmp, f'cold{i}'), fname))
+        report('cold cache', cold)
+
+        warm_dir = os.path.join(tmp, 'warm')
+        time_run('--cache-dir', warm_dir, fname)
+        report('warm cache', [time_run('--cache-dir', warm_dir, fname) for _ in range(args.runs)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('file', nargs='?', help='script to start (default: a small recursive fib)')
+    parser.add_argument('-n', '--runs', type=int, default=10)
+    main(parser.parse_args())
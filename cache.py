@@ -0,0 +1,43 @@
+"""
+On-disk cache of compiled programs.
+
+Entries are pickled vm.Code, keyed on a hash of the program text and
+grammar.tx (plus the bytecode version), so a hit needs neither the textX
+metamodel nor a parse.
+"""
+import logging
+import os
+import pickle
+
+from transpile import source_key
+import vm
+
+
+class ProgramCache:
+    def __init__(self, directory, mm):
+        """mm only gets touched on a miss - pass a LazyMetamodel to keep hits textX free."""
+        self.directory = directory
+        self.mm = mm
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, prog_str):
+        return os.path.join(self.directory, f'{source_key(prog_str)}.v{vm.BYTECODE_VERSION}.pifc')
+
+    def load(self, prog_str, parse_debug=False):
+        path = self.path(prog_str)
+        try:
+            with open(path, 'rb') as f:
+                code = pickle.load(f)
+            logging.debug('cache hit %s', path)
+            return code
+        except FileNotFoundError:
+            pass
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            logging.warning('ignoring broken cache entry %s: %s', path, e)
+
+        code = vm.compile_program(self.mm.model_from_str(prog_str, debug=parse_debug))
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(code, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        return code
@@ -1,17 +1,29 @@
+from collections import namedtuple
 import logging
 import sys
 import types
 
-from textx.model import get_model
-
 from context import Context
 from exectypes import Struct, Type
 
 
-def msg_with_position(obj, message):
+class Position(namedtuple('Position', ['line', 'col', 'kind'])):
+    """Resolved source position of a node, usable once the model is gone."""
+
+
+def position(obj):
+    if isinstance(obj, Position):
+        return obj
+    # Imported late: compiled programs never need textX.
+    from textx.model import get_model
     # super annoying interface here...
     line, col = get_model(obj)._tx_parser.pos_to_linecol(obj._tx_position)
-    return f'position ({line}, {col}) - {obj.__class__.__name__} - {message}'
+    return Position(line, col, obj.__class__.__name__)
+
+
+def msg_with_position(obj, message):
+    line, col, kind = position(obj)
+    return f'position ({line}, {col}) - {kind} - {message}'
 
 
 class ExecutionError(Exception):
@@ -27,28 +39,7 @@ def block_eval(self, c):
     for paragraph in self.paragraphs:
         debug(paragraph)
         for line in paragraph.lines:
-            debug(line)
-            try:
-                res = (line.sentence or line.statement).eval(c)
-                if res is None:
-                    assert not line.assignment
-                elif line.sentence and not line.assignment:
-                    # i.e. only push from a sentence by default
-                    # swallow things from ifs/whiles/fors to avoid noise
-                    c.push_type(res)
-                elif line.statement and line.assignment:
-                    # if we had a statement line, our result will be leftover
-                    # in most situations since they run their code in the same context.
-                    # So we throw it out if there is an assignment.
-                    c.pop_type(type(res))
-
-                if line.assignment and line.assignment.var != '_':
-                    c.push_name(line.assignment.var, res)
-            except ExecutionError:
-                raise
-            except Exception as e:
-                # nasty rewrapping... should clean up Context Exception usage.
-                raise ExecutionError(line.sentence or line.statement, e) from e
+            line.eval(c)
 
         try:
             c.result()  # validate each paragraph has at most one result
@@ -66,6 +57,31 @@ def block_eval(self, c):
     return c.result()
 
 
+def line_eval(self, c):
+    debug(self)
+    try:
+        res = (self.sentence or self.statement).eval(c)
+        if res is None:
+            assert not self.assignment
+        elif self.sentence and not self.assignment:
+            # i.e. only push from a sentence by default
+            # swallow things from ifs/whiles/fors to avoid noise
+            c.push_type(res)
+        elif self.statement and self.assignment:
+            # if we had a statement line, our result will be leftover
+            # in most situations since they run their code in the same context.
+            # So we throw it out if there is an assignment.
+            c.pop_type(type(res))
+
+        if self.assignment and self.assignment.var != '_':
+            c.push_name(self.assignment.var, res)
+    except ExecutionError:
+        raise
+    except Exception as e:
+        # nasty rewrapping... should clean up Context Exception usage.
+        raise ExecutionError(self.sentence or self.statement, e) from e
+
+
 def sentence_eval(self, c):
     debug(self)
     s_c = Context(c)
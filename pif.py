@@ -1,6 +1,3 @@
-from textx.exceptions import TextXSyntaxError
-from textx.metamodel import metamodel_from_file
-
 import argparse
 import codecs
 from collections import OrderedDict
@@ -10,13 +7,23 @@ import sys
 import types
 
 
+from cache import ProgramCache
 from context import Context
 import expression
 import execution
+from profiler import Profiler
+import transpile
+import vm
+
+
+ENGINES = ('tree', 'vm', 'python')
 
 
 def make_metamodel(parse_debug=False):
-    mm = metamodel_from_file('grammar.tx', skipws=False, ws=' ', debug=parse_debug)
+    # textX is slow to import - only pay for it when we actually parse.
+    from textx.metamodel import metamodel_from_file
+
+    mm = metamodel_from_file(transpile.GRAMMAR_FILE, skipws=False, ws=' ', debug=parse_debug)
     classes = mm.namespaces['grammar']
 
     # magically attach things from modules to automatically
@@ -30,6 +37,24 @@ def make_metamodel(parse_debug=False):
     return mm
 
 
+class LazyMetamodel:
+    """Stands in for the metamodel, building it on first use."""
+    def __init__(self, parse_debug=False):
+        self.parse_debug = parse_debug
+        self.mm = None
+
+    def __getattr__(self, name):
+        if self.mm is None:
+            self.mm = make_metamodel(parse_debug=self.parse_debug)
+        return getattr(self.mm, name)
+
+
+def syntax_errors():
+    """Exception types for a bad parse (none if textX was never loaded)."""
+    tx = sys.modules.get('textx.exceptions')
+    return (tx.TextXSyntaxError,) if tx else ()
+
+
 def make_builtin(fn, args_dict):
     def runnable(s_c):
         # Empty definition context, because, well, they're not defined 'anywhere'.
@@ -54,11 +79,23 @@ def make_context():
     return c
 
 
-def run_program(mm, prog_str, context=None, parse_debug=False):
+def run_program(mm, prog_str, context=None, parse_debug=False, engine='tree', cache=None,
+                profiler=None):
     if not context:
         context = make_context()
 
-    return mm.model_from_str(prog_str, debug=parse_debug).eval(context)
+    if cache:
+        return vm.run(cache.load(prog_str, parse_debug=parse_debug), context)
+
+    model = mm.model_from_str(prog_str, debug=parse_debug)
+    if engine == 'vm':
+        return vm.run(vm.compile_program(model), context)
+    elif engine == 'python':
+        return transpile.load_source(model)(context)
+    elif profiler:
+        with profiler.active_on(mm, context):
+            return model.eval(context)
+    return model.eval(context)
 
 
 def setup_readline():
@@ -80,7 +117,7 @@ def setup_readline():
     atexit.register(save)
 
 
-def run_repl(mm, parse_debug=False):
+def run_repl(mm, parse_debug=False, engine='tree'):
     setup_readline()
 
     c = make_context()
@@ -92,22 +129,27 @@ def run_repl(mm, parse_debug=False):
             return 0
 
         try:
-            print('<-', run_program(mm, line + '\n', context=c, parse_debug=parse_debug))
-        except (TextXSyntaxError, execution.ExecutionError) as e:
+            print('<-', run_program(mm, line + '\n', context=c, parse_debug=parse_debug, engine=engine))
+        except (*syntax_errors(), execution.ExecutionError) as e:
             logging.error(e)
 
 
-def run_files(mm, file_names, *, verbosity=0, parse_debug=False):
+def run_files(mm, file_names, *, verbosity=0, parse_debug=False, engine='tree', cache=None,
+              profiler=None):
     try:
         for fname in file_names:
-            with open(fname) as f:
-                prog_str = f.read()
-            result = run_program(mm, prog_str, parse_debug=parse_debug)
+            if engine == 'python':
+                result = transpile.load_file(mm, fname)(make_context())
+            else:
+                with open(fname) as f:
+                    prog_str = f.read()
+                result = run_program(mm, prog_str, parse_debug=parse_debug, engine=engine, cache=cache,
+                                     profiler=profiler)
             if result is not None:
                 logging.error('leftover value %s', result)
                 return 4
     # User facing errors, do not provide stack trace.
-    except TextXSyntaxError as e:
+    except syntax_errors() as e:
         (logging.exception if verbosity > 2 else logging.error)(e)
         return 2
     except execution.ExecutionError as e:
@@ -115,24 +157,73 @@ def run_files(mm, file_names, *, verbosity=0, parse_debug=False):
         return 3
 
 
-def main(args):
-    parse_debug = args.verbosity > 3
+def compile_files(mm, file_names, *, verbosity=0):
+    try:
+        for fname in file_names:
+            logging.info('compiled %s', transpile.compile_file(mm, fname))
+    except syntax_errors() as e:
+        (logging.exception if verbosity > 2 else logging.error)(e)
+        return 2
+
+
+def setup_logging(verbosity):
     logging.basicConfig(level={
         0: logging.ERROR, 1: logging.WARNING, 2: logging.INFO, 3: logging.DEBUG
-    }.get(args.verbosity, logging.DEBUG))
+    }.get(verbosity, logging.DEBUG))
+
+
+def compile_main(args):
+    setup_logging(args.verbosity)
+    sys.exit(compile_files(LazyMetamodel(), args.files, verbosity=args.verbosity))
 
-    mm = make_metamodel(parse_debug=parse_debug)
+
+def main(args):
+    parse_debug = args.verbosity > 3
+    setup_logging(args.verbosity)
+
+    mm = LazyMetamodel(parse_debug=parse_debug)
+    cache = ProgramCache(args.cache_dir, mm) if args.cache_dir else None
+    prof = Profiler() if args.profile else None
 
     if not args.files:
-        code = run_repl(mm, parse_debug=parse_debug)
+        code = run_repl(mm, parse_debug=parse_debug, engine=args.engine)
     else:
-        code = run_files(mm, args.files, verbosity=args.verbosity, parse_debug=parse_debug)
+        code = run_files(mm, args.files, verbosity=args.verbosity, parse_debug=parse_debug,
+                         engine=args.engine, cache=cache, profiler=prof)
+
+    if prof:
+        prof.report()
+        with open(args.profile_stacks, 'w') as f:
+            prof.write_collapsed(f)
 
     sys.exit(code)
 
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['compile']:
+        parser = argparse.ArgumentParser(prog='pif.py compile',
+                                         description='Transpile pif files to cached Python modules')
+        parser.add_argument('files', nargs='+', help='files to compile (foo.pif -> foo.pif.py)')
+        parser.add_argument('-v', '--verbosity', type=int, choices=[0, 1, 2, 3, 4], default=1)
+        compile_main(parser.parse_args(sys.argv[2:]))
+
     parser = argparse.ArgumentParser(description='Parameter Inference Footling (PIF)')
     parser.add_argument('files', nargs='*', help='files to execute (leave empty for REPL)')
     parser.add_argument('-v', '--verbosity', type=int, choices=[0, 1, 2, 3, 4], default=1)
-    main(parser.parse_args())
+    parser.add_argument('--engine', choices=ENGINES,
+                        help='walk the parsed model (tree, the default), compile to bytecode (vm) '
+                             'or run cached transpiled Python modules (python)')
+    parser.add_argument('--cache-dir', default=os.environ.get('PIF_CACHE_DIR'),
+                        help='keep compiled bytecode here, skipping parsing on later runs '
+                             '(implies --engine=vm; default $PIF_CACHE_DIR)')
+    parser.add_argument('--profile', action='store_true',
+                        help='report time spent per line, func and builtin (tree engine only)')
+    parser.add_argument('--profile-stacks', default='pif-profile.collapsed',
+                        help='where --profile writes collapsed stacks for flamegraph tools')
+    args = parser.parse_args()
+    if args.cache_dir and args.engine not in (None, 'vm'):
+        parser.error('--cache-dir only works with --engine=vm')
+    if args.profile and (args.cache_dir or args.engine not in (None, 'tree')):
+        parser.error('--profile only works with the tree engine')
+    args.engine = args.engine or ('vm' if args.cache_dir else 'tree')
+    main(args)
@@ -0,0 +1,132 @@
+"""
+Source level profiler for the tree-walking evaluator.
+
+Nothing here is on the normal evaluation path: while active, Profiler swaps
+the eval functions of the Line and Function grammar classes (and the
+builtins in the context) for timed wrappers, and puts the originals back
+afterwards.
+
+Frames are named by the same (line, col) that msg_with_position reports.
+"""
+from collections import Counter
+from contextlib import contextmanager
+import sys
+import time
+import types
+
+from execution import position
+
+
+class Entry:
+    __slots__ = ('kind', 'label', 'calls', 'total', 'self')
+
+    def __init__(self, kind, label):
+        self.kind = kind
+        self.label = label
+        self.calls = 0
+        self.total = 0.0
+        self.self = 0.0
+
+
+class Profiler:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.entries = {}
+        self.keys = {}
+        # [entry, start, time spent in children]
+        self.stack = []
+        self.active = Counter()
+        self.collapsed = Counter()
+
+    def entry(self, kind, label):
+        key = (kind, label)
+        if key not in self.entries:
+            self.entries[key] = Entry(kind, label)
+        return self.entries[key]
+
+    def node_entry(self, kind, node, name=None):
+        if node not in self.keys:
+            line, col, _ = position(node)
+            label = f'{name} ({line}, {col})' if name else f'{kind} ({line}, {col})'
+            self.keys[node] = self.entry(kind, label)
+        return self.keys[node]
+
+    def timed(self, entry, fn, *args):
+        self.stack.append([entry, self.clock(), 0.0])
+        self.active[entry] += 1
+        try:
+            return fn(*args)
+        finally:
+            _, start, children = self.stack.pop()
+            elapsed = self.clock() - start
+            self.active[entry] -= 1
+            entry.calls += 1
+            entry.self += elapsed - children
+            if not self.active[entry]:
+                # recursive calls are already inside the outermost one's total
+                entry.total += elapsed
+            if self.stack:
+                self.stack[-1][2] += elapsed
+            path = ';'.join([frame[0].label for frame in self.stack] + [entry.label])
+            self.collapsed[path] += elapsed - children
+
+    def wrap_builtins(self, c):
+        for (name, val) in list(c.n_v.items()):
+            if isinstance(val, types.FunctionType):
+                c.n_v[name] = self._wrap_builtin(self.entry('builtin', name), val)
+
+    def _wrap_builtin(self, entry, fn):
+        def profiled(s_c):
+            return self.timed(entry, fn, s_c)
+
+        return profiled
+
+    @contextmanager
+    def active_on(self, mm, c):
+        """Profile evaluation through mm's classes, and the builtins in c."""
+        classes = mm.namespaces['grammar']
+        line_cls, function_cls = classes['Line'], classes['Function']
+        line_eval, function_eval = line_cls.eval, function_cls.eval
+        profiler = self
+
+        def profiled_line_eval(line, c):
+            return profiler.timed(profiler.node_entry('line', line.sentence or line.statement),
+                                  line_eval, line, c)
+
+        def profiled_function_eval(function, definition_context):
+            runnable = function_eval(function, definition_context)
+            entry = profiler.node_entry('func', function, name=_function_name(function))
+
+            def profiled(s_c):
+                return profiler.timed(entry, runnable, s_c)
+
+            return profiled
+
+        self.wrap_builtins(c)
+        line_cls.eval, function_cls.eval = profiled_line_eval, profiled_function_eval
+        try:
+            yield self
+        finally:
+            line_cls.eval, function_cls.eval = line_eval, function_eval
+
+    def report(self, out=sys.stderr, limit=None):
+        entries = sorted((e for e in self.entries.values() if e.calls), key=lambda e: e.total, reverse=True)
+        print(f'{"calls":>8} {"total ms":>10} {"self ms":>10} {"ms/call":>9}  kind     location', file=out)
+        for e in entries[:limit]:
+            per_call = e.total / e.calls if e.calls else 0.0
+            print(f'{e.calls:>8} {e.total * 1000:>10.3f} {e.self * 1000:>10.3f} {per_call * 1000:>9.4f}'
+                  f'  {e.kind:<8} {e.label}', file=out)
+
+    def write_collapsed(self, out):
+        """Write stacks in the collapsed format flamegraph.pl and friends read (values in us)."""
+        for (path, seconds) in sorted(self.collapsed.items()):
+            out.write(f'{path} {round(seconds * 1e6)}\n')
+
+
+def _function_name(function):
+    # Pushable -> Instruction -> Sentence -> Line, for the usual `name = func ... end`
+    sentence = function.parent.parent.parent
+    line = getattr(sentence, 'parent', None)
+    if getattr(line, 'assignment', None) and line.sentence is sentence and len(sentence.instructions) == 1:
+        return line.assignment.var
+    return 'func'
@@ -0,0 +1,60 @@
+from unittest import TestCase
+import os
+import subprocess
+import sys
+import tempfile
+
+from cache import ProgramCache
+from pif import make_context, make_metamodel
+import vm
+
+
+mm = make_metamodel()
+
+PROGRAM = '''
+f = func (n number) ((n * 2)) end
+f 21 .
+'''
+
+
+class Cache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def test_hit_needs_no_metamodel(self):
+        ProgramCache(self.dir.name, mm).load(PROGRAM)
+        code = ProgramCache(self.dir.name, None).load(PROGRAM)
+        self.assertEqual(42.0, vm.run(code, make_context()))
+
+    def test_keyed_on_source(self):
+        cache = ProgramCache(self.dir.name, mm)
+        cache.load(PROGRAM)
+        self.assertNotEqual(cache.path(PROGRAM), cache.path(PROGRAM + '\n'))
+        self.assertEqual(1, len(os.listdir(self.dir.name)))
+
+    def test_broken_entry_recompiled(self):
+        cache = ProgramCache(self.dir.name, mm)
+        with open(cache.path(PROGRAM), 'wb') as f:
+            f.write(b'garbage')
+        with self.assertLogs(level='WARNING'):
+            code = cache.load(PROGRAM)
+        self.assertEqual(42.0, vm.run(code, make_context()))
+
+    def test_warm_run_skips_textx(self):
+        fname = os.path.join(self.dir.name, 'prog.pif')
+        with open(fname, 'w') as f:
+            f.write('"x" eat_s .\n')
+        check = (
+            'import runpy, sys\n'
+            f'sys.argv = ["pif.py", "--cache-dir", {self.dir.name!r}, {fname!r}]\n'
+            'try:\n'
+            '    runpy.run_path("pif.py", run_name="__main__")\n'
+            'except SystemExit:\n'
+            '    pass\n'
+            'print("textx" in sys.modules)\n'
+        )
+        here = os.path.dirname(os.path.abspath(__file__))
+        runs = [subprocess.run([sys.executable, '-c', check], cwd=here, capture_output=True, text=True)
+                for _ in range(2)]
+        self.assertEqual(['True', 'False'], [r.stdout.strip() for r in runs])
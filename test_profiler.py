@@ -0,0 +1,66 @@
+from unittest import TestCase
+import io
+import itertools
+
+from pif import run_program, make_metamodel
+from profiler import Profiler
+
+
+mm = make_metamodel()
+
+PROGRAM = '''fib = func (n number)
+  if ((n <= 2)) do
+    1
+  else
+    a = fib ((n - 1)) .
+    b = fib ((n - 2)) .
+    ((a + b))
+  end
+end
+
+fib 5 . eat_f .
+'''
+
+
+class Profile(TestCase):
+    def setUp(self):
+        # every clock read is one 'second' later
+        self.profiler = Profiler(clock=itertools.count().__next__)
+        run_program(mm, PROGRAM, profiler=self.profiler)
+
+    def counts(self):
+        return {label: e.calls for ((kind, label), e) in self.profiler.entries.items()}
+
+    def test_counts(self):
+        counts = self.counts()
+        self.assertEqual(9, counts['fib (1, 7)'])
+        self.assertEqual(9, counts['line (2, 3)'])
+        self.assertEqual(4, counts['line (5, 8)'])
+        self.assertEqual(1, counts['eat_f'])
+        self.assertEqual(0, counts['print_s'])
+
+    def test_recursion_not_double_counted(self):
+        entries = {label: e for ((kind, label), e) in self.profiler.entries.items()}
+        top = entries['line (11, 1)']
+        self.assertGreaterEqual(top.total, entries['fib (1, 7)'].total)
+        self.assertEqual(entries['line (1, 6)'].total + top.total, sum(e.self for e in entries.values()))
+
+    def test_collapsed(self):
+        out = io.StringIO()
+        self.profiler.write_collapsed(out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('line (11, 1);fib (1, 7);line (2, 3);line (5, 8);fib (1, 7)',
+                      [line.rsplit(' ', 1)[0] for line in lines])
+        self.assertIn('line (11, 1);eat_f', [line.rsplit(' ', 1)[0] for line in lines])
+
+    def test_report_sorted(self):
+        out = io.StringIO()
+        self.profiler.report(out=out)
+        totals = [float(line.split()[1]) for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual(sorted(totals, reverse=True), totals)
+        self.assertNotIn('print_s', out.getvalue())
+
+    def test_uninstalled(self):
+        classes = mm.namespaces['grammar']
+        self.assertEqual('line_eval', classes['Line'].eval.__name__)
+        self.assertEqual('function_eval', classes['Function'].eval.__name__)
@@ -0,0 +1,51 @@
+"""
+Run the functional test suite through transpiled Python, and check the module cache.
+"""
+from unittest import TestCase
+import os
+import tempfile
+
+from pif import run_program, make_context, make_metamodel
+import test_context
+import test_pif
+from test_vm import engine_cases
+import transpile
+
+
+mm = make_metamodel()
+
+
+def run(prog_str):
+    return run_program(mm, prog_str, engine='python')
+
+
+globals().update(engine_cases([test_pif, test_context], run))
+
+
+class ModuleCache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.fname = os.path.join(self.dir.name, 'prog.pif')
+        self.write('((1 + 2))\n')
+
+    def write(self, prog_str):
+        with open(self.fname, 'w') as f:
+            f.write(prog_str)
+
+    def test_written_next_to_source(self):
+        path = transpile.compile_file(mm, self.fname)
+        self.assertEqual(self.fname + '.py', path)
+        with open(path) as f:
+            self.assertIn(transpile.source_key('((1 + 2))\n'), f.read())
+        self.assertEqual(3.0, transpile.load_file(mm, self.fname)(make_context()))
+
+    def test_reused_until_source_changes(self):
+        path = transpile.compile_file(mm, self.fname)
+        mtime = os.stat(path).st_mtime_ns
+        os.utime(path, ns=(mtime - 10**9, mtime - 10**9))
+        transpile.compile_file(mm, self.fname)
+        self.assertEqual(mtime - 10**9, os.stat(path).st_mtime_ns)
+
+        self.write('((2 + 2))\n')
+        self.assertEqual(4.0, transpile.load_file(mm, self.fname)(make_context()))
@@ -0,0 +1,56 @@
+"""
+Run the whole functional test suite again, but through the bytecode VM.
+"""
+from unittest import TestCase, mock
+import pickle
+
+from pif import run_program, make_context, make_metamodel
+import test_context
+import test_pif
+import vm
+
+
+mm = make_metamodel()
+
+
+def run(prog_str):
+    return run_program(mm, prog_str, engine='vm')
+
+
+def _with_engine(module, case, run):
+    class EngineCase(case):
+        def setUp(self):
+            super().setUp()
+            patcher = mock.patch.object(module, 'run', run)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    EngineCase.__name__ = EngineCase.__qualname__ = case.__name__
+    return EngineCase
+
+
+def engine_cases(modules, run):
+    """Subclass every TestCase in modules so it runs programs with `run`."""
+    for module in modules:
+        for name, case in vars(module).items():
+            if isinstance(case, type) and issubclass(case, TestCase) and case.__module__ == module.__name__:
+                yield f'{module.__name__}_{name}', _with_engine(module, case, run)
+
+
+globals().update(engine_cases([test_pif, test_context], run))
+
+
+class Bytecode(TestCase):
+    def test_pickle(self):
+        code = vm.compile_program(mm.model_from_str('''
+            f = func (n number) ((n * 2)) end
+            f 21 .
+        '''))
+        self.assertEqual(42.0, vm.run(pickle.loads(pickle.dumps(code)), make_context()))
+
+    def test_error_position(self):
+        with self.assertRaisesRegex(Exception, r'position \(3, 13\) - While - while condition'):
+            run('''
+            f = func () end
+            while f . do 1 end
+            ''')
@@ -0,0 +1,350 @@
+"""
+Ahead-of-time transpiler from a parsed pif Program to Python source.
+
+Each Block becomes a Python function taking the Context it runs in.
+Sentences still build a sentence Context (that is where type directed
+resolution happens), but control flow, arithmetic and line bookkeeping
+become plain Python that CPython runs directly.
+
+compile_file writes the generated module next to the pif source
+(foo.pif -> foo.pif.py), tagged with a hash of the source and grammar.tx,
+so the module (and CPython's own .pyc of it) is reused until either changes.
+"""
+from contextlib import contextmanager
+import hashlib
+import importlib.util
+import math
+import os
+import re
+import types
+
+from context import Context
+from exectypes import Struct, Type
+from execution import ExecutionError, position
+
+
+GRAMMAR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grammar.tx')
+
+FunctionType = types.FunctionType
+
+
+def source_key(prog_str):
+    """Hash identifying prog_str as parsed by the current grammar."""
+    h = hashlib.sha256()
+    with open(GRAMMAR_FILE, 'rb') as f:
+        h.update(f.read())
+    h.update(prog_str.encode())
+    return h.hexdigest()
+
+
+# Runtime support - the generated code calls back into these.
+
+def number(c, name):
+    val = c.get_name(name)
+    if isinstance(val, float) or isinstance(val, int):
+        return val
+    elif val == float or val == int:
+        return c.pop_type(val)
+    else:
+        raise Exception('expressions can only have numbers')
+
+
+def make_type(spec, c):
+    return Type({name: c.get_name(t) for (name, t) in spec})
+
+
+def make_function(body, arg_dict, definition_context):
+    def runnable(s_c):
+        return body(definition_context.new_function_context(s_c, arg_dict))
+
+    return runnable
+
+
+def make_struct(keys, values, type_name, pos, c):
+    s = Struct(zip(keys, values))
+    if type_name and not s.type.obeys(c.get_name(type_name)):
+        raise ExecutionError(pos, f'not a valid {type_name}')
+    return s
+
+
+HEADER = '''\
+# Generated by pif from {name} - do not edit.
+from context import Context
+from execution import ExecutionError, Position
+from transpile import (
+    FunctionType, make_function as _make_function, make_struct as _make_struct,
+    make_type as _make_type, number as _num,
+)
+
+SOURCE_HASH = {key!r}
+'''
+
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+        self.depth = 0
+        self.tmp = 0
+
+    def __call__(self, text):
+        self.lines.append('    ' * self.depth + text)
+
+    @contextmanager
+    def indented(self, levels=1):
+        self.depth += levels
+        yield
+        self.depth -= levels
+
+    def temp(self, prefix='_t'):
+        self.tmp += 1
+        return f'{prefix}{self.tmp}'
+
+
+class Transpiler:
+    def __init__(self):
+        self.positions = {}
+        self.functions = []
+
+    def source(self, model, name='<string>', key=None):
+        main = self.block_function('run', model)
+        consts = [f'{n} = Position{tuple(p)!r}' for (p, n) in self.positions.items()]
+        return '\n'.join([HEADER.format(name=name, key=key), *consts, '', *self.functions, main])
+
+    def pos(self, node):
+        p = position(node)
+        if p not in self.positions:
+            self.positions[p] = f'_P{len(self.positions)}'
+        return self.positions[p]
+
+    def block_function(self, name, block):
+        w = _Writer()
+        w(f'def {name}(c):')
+        with w.indented():
+            w('_p = None')
+            w('try:')
+            with w.indented():
+                if block:
+                    self.block(w, block)
+                    w('_p = None')
+                    w('return c.result()')
+                else:
+                    w('return None')
+            w('except ExecutionError:')
+            w('    raise')
+            w('except Exception as e:')
+            w('    if _p is None:')
+            w('        raise')
+            w('    # same rewrapping as block_eval does per line')
+            w('    raise ExecutionError(_p, e) from e')
+        return '\n'.join(w.lines) + '\n\n'
+
+    def function(self, function):
+        name = f'_func{len(self.functions)}'
+        # reserve the slot first, nested functions get appended while we build this one.
+        self.functions.append(None)
+        index = len(self.functions) - 1
+        self.functions[index] = self.block_function(name, function.block)
+        return name
+
+    def block(self, w, block):
+        for paragraph in block.paragraphs:
+            for line in paragraph.lines:
+                self.line(w, line)
+            w(f'_p = {self.pos(paragraph)}')
+            w('c.result()')
+
+    def line(self, w, line):
+        node = line.sentence or line.statement
+        p = self.pos(node)
+        w(f'_p = {p}')
+        if line.sentence:
+            res = self.sentence(w, line.sentence)
+        else:
+            res = getattr(self, f'{node.__class__.__name__.lower()}_')(w, node, p)
+
+        var = line.assignment.var if line.assignment else None
+        if var is None:
+            if line.sentence:
+                w(f'if {res} is not None:')
+                w(f'    c.push_type({res})')
+        else:
+            w(f'assert {res} is not None')
+            if line.statement:
+                w(f'c.pop_type(type({res}))')
+            if var != '_':
+                w(f'c.push_name({var!r}, {res})')
+
+    def sentence(self, w, sentence):
+        s = w.temp('_s')
+        w(f'{s} = Context(c)')
+        for instruction in sentence.instructions:
+            if instruction.pushable and not instruction.exec:
+                w(f'{s}.push_type({self.pushable(w, instruction.pushable)})')
+
+            if instruction.exec:
+                if instruction.pushable:
+                    f = self.pushable(w, instruction.pushable)
+                else:
+                    f = f'{s}.pop_type(FunctionType)'
+                w(f'_f = {f}')
+                w(f'_v = _f({s})')
+                w('if _v is not None:')
+                w(f'    {s}.push_type(_v)')
+        res = w.temp()
+        w(f'{res} = {s}.result()')
+        return res
+
+    def pushable(self, w, pushable):
+        if pushable.var:
+            return f'c.get_name({pushable.var!r})'
+        elif pushable.expr:
+            return self.expression(pushable.expr.e)
+        elif pushable.function:
+            body = self.function(pushable.function)
+            return f'_make_function({body}, _make_type({argspec(pushable.function.args)!r}, c), c)'
+        elif pushable.type:
+            return f'_make_type({argspec(pushable.type)!r}, c)'
+        elif pushable.struct:
+            struct = pushable.struct
+            values = [self.sentence(w, s) for s in struct.sentences]
+            keys = tuple(assign.var for assign in struct.assigns)
+            return (f'_make_struct({keys!r}, [{", ".join(values)}], {struct.type!r}, '
+                    f'{self.pos(struct)}, c)')
+        elif hasattr(pushable.rawval, 'sentences'):
+            values = [self.sentence(w, s) for s in pushable.rawval.sentences]
+            return f'[{", ".join(values)}]'
+        elif hasattr(pushable.rawval, 'keys'):
+            items = []
+            for (k, v) in zip(pushable.rawval.keys, pushable.rawval.values):
+                items.append(f'{self.sentence(w, k)}: {self.sentence(w, v)}')
+            return f'{{{", ".join(items)}}}'
+        else:
+            return literal(pushable.rawval)
+
+    def expression(self, expr):
+        if hasattr(expr, 'ops'):
+            total = self.expression(expr.expr)
+            for (op, e) in zip(expr.ops, expr.exprs):
+                total = f'({total} {op} {self.expression(e)})'
+            return total
+        elif expr.id:
+            return f'_num(c, {expr.id!r})'
+        elif expr.expr:
+            return self.expression(expr.expr)
+        else:
+            return literal(expr.num)
+
+    def if_(self, w, node, line_pos):
+        res = w.temp()
+        pairs = list(zip([node.condition] + (node.elif_conditions or []),
+                         [node.block] + (node.elif_blocks or [])))
+        for (depth, (cond, block)) in enumerate(pairs):
+            with w.indented(depth):
+                t = self.sentence(w, cond)
+                w(f'if {t} is None:')
+                w(f'    raise ExecutionError({self.pos(node)}, "if condition must have result")')
+                w(f'if {t}:')
+                with w.indented():
+                    self.block(w, block)
+                    w(f'_p = {line_pos}')
+                    w(f'{res} = c.result()')
+                w('else:')
+        with w.indented(len(pairs)):
+            if node.else_block:
+                self.block(w, node.else_block)
+                w(f'_p = {line_pos}')
+                w(f'{res} = c.result()')
+            else:
+                w(f'{res} = None')
+        return res
+
+    def while_(self, w, node, line_pos):
+        res = w.temp()
+        w(f'{res} = None')
+        w('while True:')
+        with w.indented():
+            t = self.sentence(w, node.condition)
+            w(f'if {t} is None:')
+            w(f'    raise ExecutionError({self.pos(node)}, "while condition must have result")')
+            w(f'if not {t}:')
+            w('    break')
+            self.block(w, node.block)
+            w(f'_p = {line_pos}')
+            w(f'{res} = c.result()')
+        return res
+
+    def for_(self, w, node, line_pos):
+        res = w.temp()
+        w(f'{res} = None')
+        seq = self.sentence(w, node.sentence)
+        elem = w.temp('_e')
+        w(f'for {elem} in {seq}:')
+        with w.indented():
+            if not node.var:
+                w(f'c.push_type({elem})')
+            elif node.var != '_':
+                w(f'c.push_name({node.var!r}, {elem})')
+            self.block(w, node.block)
+            w(f'_p = {line_pos}')
+            w(f'{res} = c.result()')
+        return res
+
+
+def literal(val):
+    if isinstance(val, float) and not math.isfinite(val):
+        return f'float({str(val)!r})'
+    return repr(val)
+
+
+def argspec(type_node):
+    return tuple((entry.name, entry.type) for entry in type_node.varsWithType)
+
+
+def to_python(model, name='<string>', key=None):
+    return Transpiler().source(model, name=name, key=key)
+
+
+def load_source(model, name='<string>'):
+    """Transpile and load a parsed model without touching the disk."""
+    namespace = {}
+    exec(compile(to_python(model, name), name, 'exec'), namespace)
+    return namespace['run']
+
+
+def module_path(fname):
+    return fname + '.py'
+
+
+def compile_file(mm, fname):
+    """Write (if stale) the cached module for fname and return its path."""
+    with open(fname) as f:
+        prog_str = f.read()
+    key = source_key(prog_str)
+    path = module_path(fname)
+    if _cached_key(path) != key:
+        source = to_python(mm.model_from_str(prog_str), name=os.path.basename(fname), key=key)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(source)
+        os.replace(tmp, path)
+    return path
+
+
+def load_file(mm, fname):
+    path = compile_file(mm, fname)
+    name = re.sub(r'\W', '_', os.path.basename(fname))
+    spec = importlib.util.spec_from_file_location(f'_pif_{name}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.run
+
+
+def _cached_key(path):
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('SOURCE_HASH = '):
+                    return line.split('=', 1)[1].strip().strip('\'"')
+    except FileNotFoundError:
+        pass
+    return None
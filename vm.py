@@ -0,0 +1,370 @@
+"""
+Bytecode compiler and stack VM - an alternative to walking the textX model.
+
+compile_program flattens a parsed Block into a Code object: a flat list of
+(opcode, arg) pairs, plus the Position each instruction reports errors
+against. run executes Code against the same Context objects (and with the
+same semantics) as the *_eval functions in execution.py.
+"""
+import types
+
+from context import Context
+from exectypes import Struct, Type
+from execution import ExecutionError, position
+from expression import OPS
+
+
+# Bump whenever the compiled form changes, so on-disk caches get invalidated.
+BYTECODE_VERSION = 1
+
+(
+    CONST,
+    GET_NAME,
+    LOAD_NUM,
+    BINOP,
+    SENTENCE,
+    SPUSH,
+    SPOP_FUNCTION,
+    CALL,
+    SENTENCE_END,
+    LINE,
+    PARAGRAPH_END,
+    BLOCK_RESULT,
+    RETURN,
+    TEST_JUMP,
+    JUMP,
+    POP,
+    GET_ITER,
+    FOR_ITER,
+    MAKE_FUNCTION,
+    MAKE_TYPE,
+    MAKE_STRUCT,
+    BUILD_LIST,
+    BUILD_DICT,
+) = range(23)
+
+OPNAMES = [
+    'CONST', 'GET_NAME', 'LOAD_NUM', 'BINOP', 'SENTENCE', 'SPUSH', 'SPOP_FUNCTION',
+    'CALL', 'SENTENCE_END', 'LINE', 'PARAGRAPH_END', 'BLOCK_RESULT', 'RETURN',
+    'TEST_JUMP', 'JUMP', 'POP', 'GET_ITER', 'FOR_ITER', 'MAKE_FUNCTION', 'MAKE_TYPE',
+    'MAKE_STRUCT', 'BUILD_LIST', 'BUILD_DICT',
+]
+
+
+class Code:
+    """A compiled block. Only holds plain data, so it can be pickled."""
+    __slots__ = ('ops', 'positions')
+
+    def __init__(self, ops, positions):
+        self.ops = ops
+        self.positions = positions
+
+    def __getstate__(self):
+        return self.ops, self.positions
+
+    def __setstate__(self, state):
+        self.ops, self.positions = state
+
+    def dis(self):
+        lines = []
+        for pc, (op, arg) in enumerate(self.ops):
+            if isinstance(arg, Code) or (isinstance(arg, tuple) and arg and isinstance(arg[0], Code)):
+                arg = '<code>'
+            lines.append(f'{pc:4} {OPNAMES[op]:<14} {"" if arg is None else arg}')
+        return '\n'.join(lines)
+
+
+class Compiler:
+    def __init__(self):
+        self.ops = []
+        self.positions = []
+        # Errors are reported against the innermost enclosing line,
+        # just like block_eval does.
+        self.pos = None
+
+    def emit(self, op, arg=None):
+        self.ops.append((op, arg))
+        self.positions.append(self.pos)
+        return len(self.ops) - 1
+
+    def here(self):
+        return len(self.ops)
+
+    def patch(self, index, arg):
+        self.ops[index] = (self.ops[index][0], arg)
+
+    def code(self):
+        return Code(self.ops, self.positions)
+
+    def block(self, block):
+        for paragraph in block.paragraphs:
+            for line in paragraph.lines:
+                self.line(line)
+            self.pos = position(paragraph)
+            self.emit(PARAGRAPH_END)
+
+    def line(self, line):
+        node = line.sentence or line.statement
+        self.pos = position(node)
+        if line.sentence:
+            self.sentence(line.sentence)
+        else:
+            getattr(self, f'{node.__class__.__name__.lower()}_')(node)
+        self.pos = position(node)
+        assignment = line.assignment.var if line.assignment else None
+        self.emit(LINE, (bool(line.sentence), assignment))
+
+    def sentence(self, sentence):
+        self.emit(SENTENCE)
+        for instruction in sentence.instructions:
+            if instruction.pushable and not instruction.exec:
+                self.pushable(instruction.pushable)
+                self.emit(SPUSH)
+
+            if instruction.exec:
+                if instruction.pushable:
+                    self.pushable(instruction.pushable)
+                else:
+                    self.emit(SPOP_FUNCTION)
+                self.emit(CALL)
+        self.emit(SENTENCE_END)
+
+    def pushable(self, pushable):
+        if pushable.var:
+            self.emit(GET_NAME, pushable.var)
+        elif pushable.expr:
+            self.expression(pushable.expr.e)
+        elif pushable.function:
+            self.emit(MAKE_FUNCTION, (compile_function(pushable.function), argspec(pushable.function.args)))
+        elif pushable.type:
+            self.emit(MAKE_TYPE, argspec(pushable.type))
+        elif pushable.struct:
+            struct = pushable.struct
+            for sentence in struct.sentences:
+                self.sentence(sentence)
+            keys = tuple(assign.var for assign in struct.assigns)
+            self.emit(MAKE_STRUCT, (keys, struct.type, position(struct)))
+        elif hasattr(pushable.rawval, 'sentences'):
+            for sentence in pushable.rawval.sentences:
+                self.sentence(sentence)
+            self.emit(BUILD_LIST, len(pushable.rawval.sentences))
+        elif hasattr(pushable.rawval, 'keys'):
+            for (k, v) in zip(pushable.rawval.keys, pushable.rawval.values):
+                self.sentence(k)
+                self.sentence(v)
+            self.emit(BUILD_DICT, len(pushable.rawval.keys))
+        else:
+            self.emit(CONST, pushable.rawval)
+
+    def expression(self, expr):
+        # Expression0/1/2 all share a shape (expr, ops, exprs); Value is the leaf.
+        if hasattr(expr, 'ops'):
+            self.expression(expr.expr)
+            for (op, e) in zip(expr.ops, expr.exprs):
+                self.expression(e)
+                self.emit(BINOP, OPS[op])
+        elif expr.id:
+            self.emit(LOAD_NUM, expr.id)
+        elif expr.expr:
+            self.expression(expr.expr)
+        else:
+            self.emit(CONST, expr.num)
+
+    def _block_result(self, block):
+        self.block(block)
+        self.emit(BLOCK_RESULT)
+
+    def if_(self, node):
+        self.pos = position(node)
+        ends = []
+        for (cond, block) in zip([node.condition] + (node.elif_conditions or []),
+                                 [node.block] + (node.elif_blocks or [])):
+            self.sentence(cond)
+            self.pos = position(node)
+            test = self.emit(TEST_JUMP)
+            self._block_result(block)
+            self.pos = position(node)
+            ends.append(self.emit(JUMP))
+            self.patch(test, ('if condition must have result', position(node), self.here()))
+
+        if node.else_block:
+            self._block_result(node.else_block)
+        else:
+            self.emit(CONST, None)
+
+        for end in ends:
+            self.patch(end, self.here())
+
+    def while_(self, node):
+        self.pos = position(node)
+        self.emit(CONST, None)  # last_eval
+        start = self.here()
+        self.sentence(node.condition)
+        self.pos = position(node)
+        test = self.emit(TEST_JUMP)
+        self.emit(POP)
+        self._block_result(node.block)
+        self.pos = position(node)
+        self.emit(JUMP, start)
+        self.patch(test, ('while condition must have result', position(node), self.here()))
+
+    def for_(self, node):
+        self.pos = position(node)
+        self.sentence(node.sentence)
+        self.emit(GET_ITER)
+        self.emit(CONST, None)  # last_eval
+        start = self.here()
+        step = self.emit(FOR_ITER)
+        self.emit(POP)
+        self._block_result(node.block)
+        self.pos = position(node)
+        self.emit(JUMP, start)
+        self.patch(step, (node.var, self.here()))
+
+
+def argspec(type_node):
+    return tuple((entry.name, entry.type) for entry in type_node.varsWithType)
+
+
+def compile_block(block):
+    compiler = Compiler()
+    if block:
+        compiler.block(block)
+        compiler.emit(BLOCK_RESULT)
+    else:
+        compiler.emit(CONST, None)
+    compiler.emit(RETURN)
+    return compiler.code()
+
+
+def compile_function(function):
+    return compile_block(function.block)
+
+
+def compile_program(model):
+    return compile_block(model)
+
+
+def make_type(spec, c):
+    return Type({name: c.get_name(t) for (name, t) in spec})
+
+
+def make_function(code, arg_dict, definition_context):
+    def runnable(s_c):
+        return run(code, definition_context.new_function_context(s_c, arg_dict))
+
+    return runnable
+
+
+def run(code, c):
+    ops = code.ops
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    sentences = []
+    pc = 0
+    try:
+        while True:
+            op, arg = ops[pc]
+            pc += 1
+            if op == SPUSH:
+                sentences[-1].push_type(pop())
+            elif op == GET_NAME:
+                push(c.get_name(arg))
+            elif op == CONST:
+                push(arg)
+            elif op == LOAD_NUM:
+                val = c.get_name(arg)
+                if isinstance(val, float) or isinstance(val, int):
+                    push(val)
+                elif val == float or val == int:
+                    push(c.pop_type(val))
+                else:
+                    raise Exception('expressions can only have numbers')
+            elif op == BINOP:
+                right = pop()
+                push(arg(pop(), right))
+            elif op == SENTENCE:
+                sentences.append(Context(c))
+            elif op == SENTENCE_END:
+                push(sentences.pop().result())
+            elif op == CALL:
+                s_c = sentences[-1]
+                val = pop()(s_c)
+                if val is not None:
+                    s_c.push_type(val)
+            elif op == SPOP_FUNCTION:
+                push(sentences[-1].pop_type(types.FunctionType))
+            elif op == LINE:
+                is_sentence, assignment = arg
+                res = pop()
+                if res is None:
+                    assert assignment is None
+                elif is_sentence and assignment is None:
+                    c.push_type(res)
+                elif not is_sentence and assignment is not None:
+                    c.pop_type(type(res))
+
+                if assignment is not None and assignment != '_':
+                    c.push_name(assignment, res)
+            elif op == TEST_JUMP:
+                message, pos, target = arg
+                res = pop()
+                if res is None:
+                    raise ExecutionError(pos, message)
+                elif not res:
+                    pc = target
+            elif op == JUMP:
+                pc = arg
+            elif op == POP:
+                pop()
+            elif op == FOR_ITER:
+                var, target = arg
+                try:
+                    elem = next(stack[-2])
+                except StopIteration:
+                    del stack[-2]
+                    pc = target
+                else:
+                    if not var:
+                        c.push_type(elem)
+                    elif var != '_':
+                        c.push_name(var, elem)
+            elif op == PARAGRAPH_END:
+                c.result()
+            elif op == BLOCK_RESULT:
+                push(c.result())
+            elif op == RETURN:
+                return pop()
+            elif op == GET_ITER:
+                push(iter(pop()))
+            elif op == MAKE_FUNCTION:
+                push(make_function(arg[0], make_type(arg[1], c), c))
+            elif op == MAKE_TYPE:
+                push(make_type(arg, c))
+            elif op == MAKE_STRUCT:
+                keys, type_name, pos = arg
+                values = stack[len(stack) - len(keys):]
+                del stack[len(stack) - len(keys):]
+                s = Struct(zip(keys, values))
+                if type_name and not s.type.obeys(c.get_name(type_name)):
+                    raise ExecutionError(pos, f'not a valid {type_name}')
+                push(s)
+            elif op == BUILD_LIST:
+                values = stack[len(stack) - arg:]
+                del stack[len(stack) - arg:]
+                push(values)
+            elif op == BUILD_DICT:
+                items = stack[len(stack) - 2 * arg:]
+                del stack[len(stack) - 2 * arg:]
+                push(dict(zip(items[::2], items[1::2])))
+            else:
+                raise Exception(f'internal error - bad opcode {op}')
+    except ExecutionError:
+        raise
+    except Exception as e:
+        pos = code.positions[pc - 1]
+        if pos is None:
+            raise
+        # same rewrapping as block_eval does per line
+        raise ExecutionError(pos, e) from e